@@ -1,12 +1,13 @@
 from flask import Flask, render_template, request, send_file, jsonify
 import os
 from dotenv import load_dotenv
-from image_generator import generate_survey_image
+from image_generator import configure_logging, generate_survey_image, get_cached_base64, get_cached_thumbnail
 from text_generation import generate_email
 
 app = Flask(__name__)
 
 load_dotenv()
+configure_logging()
 
 @app.route('/')
 def index():
@@ -23,6 +24,8 @@ def generate():
     loi = request.form.get('loi')
     educational_info = request.form.get('educational_info')
     include_text = request.form.get('include_text') == 'on'
+    # Clients that explicitly accept WebP (e.g. email renderers) get a smaller inline image
+    inline_format = "WEBP" if any(value == 'image/webp' for value, _ in request.accept_mimetypes) else "PNG"
 
     # Validate inputs
     errors = []
@@ -46,7 +49,8 @@ def generate():
     # Generate image - now using only 2 parameters
     pil_image, image_filename, image_base64, image_message = generate_survey_image(
         survey_name=survey_name,
-        medical_specialty=medical_specialty
+        medical_specialty=medical_specialty,
+        inline_format=inline_format
     )
 
     if not image_filename:
@@ -56,11 +60,23 @@ def generate():
         "success": True,
         "email_content": email_content,
         "image_base64": image_base64,
+        "image_mime": f"image/{inline_format.lower()}",
         "image_filename": image_filename,
         "image_description": image_message,
         "download_url": f"/download/{image_filename}"
     })
 
+@app.route('/image/<path:filename>')
+def image(filename):
+    # Serve recently generated images from the in-memory base64 cache
+    if request.args.get('thumbnail'):
+        image_base64 = get_cached_thumbnail(filename)
+    else:
+        image_base64 = get_cached_base64(filename)
+    if image_base64 is None:
+        return jsonify({"success": False, "errors": ["Image not found."]}), 404
+    return jsonify({"success": True, "image_base64": image_base64})
+
 @app.route('/download/<path:filename>')
 def download(filename):
     return send_file(filename, as_attachment=True)
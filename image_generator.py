@@ -1,74 +1,208 @@
 import os
+import re
+import sys
+import string
+import time
+import queue
+import logging
+import logging.handlers
+import random
+import uuid
+import atexit
+import asyncio
+import threading
 import datetime
 import base64
+import hashlib
+import functools
+import weakref
+import shutil
 from io import BytesIO
-from PIL import Image as PILImage
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
 from dotenv import load_dotenv
 
+# Heavy imports (google.genai, httpx, PIL) are deferred to first use so that
+# importing this module, e.g. from app.py, doesn't pay for them on cold start
+
 load_dotenv()
+
+logger = logging.getLogger(__name__)
+_log_listener = None
+
+def configure_logging(level=logging.INFO):
+    """Send log records to stdout through a background thread so a slow pipe never stalls a request.
+
+    Meant for the application entry point; calling it more than once is a no-op.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 if not GEMINI_API_KEY:
     raise ValueError("No Gemini API key found. Please set the GEMINI_API_KEY environment variable.")
 
-# Initialize Google GenAI client with error handling
+# Google GenAI client, initialized with error handling on first use by _get_client()
 client = None
-GEMINI_AVAILABLE = False
-try:
-    from google import genai
-    from google.genai import types
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    GEMINI_AVAILABLE = True
-    print("Using new Google GenAI client")
-except ImportError as e:
-    print(f"Import error for new Google GenAI: {str(e)}")
+types = None
+GEMINI_AVAILABLE = None  # None until _get_client() has run
+_CLIENT_LOCK = threading.Lock()
+
+def _get_client():
+    global client, types, GEMINI_AVAILABLE
+    if GEMINI_AVAILABLE is not None:
+        return client
+    with _CLIENT_LOCK:
+        if GEMINI_AVAILABLE is not None:
+            return client
+        try:
+            import httpx
+            from google import genai
+            from google.genai import types as genai_types
+            # One keep-alive connection pool per process so calls after the first skip the TCP/TLS handshake
+            http_client_args = {"limits": httpx.Limits(max_keepalive_connections=20, max_connections=100)}
+            new_client = genai.Client(
+                api_key=GEMINI_API_KEY,
+                # The SDK passes HttpOptions.timeout (ms) on every request, overriding any httpx client default
+                http_options=genai_types.HttpOptions(
+                    timeout=GEMINI_TIMEOUT_MS, client_args=http_client_args, async_client_args=http_client_args)
+            )
+            atexit.register(_close_client, new_client)
+            client, types = new_client, genai_types
+            GEMINI_AVAILABLE = True
+            logger.info("Using new Google GenAI client")
+        except ImportError as e:
+            logger.warning("Import error for new Google GenAI: %s", e)
+            # google-generativeai only serves text models here, so every image call would fail before the fallback
+            logger.warning("Image generation requires google-genai, using fallback only")
+            GEMINI_AVAILABLE = False
+        except Exception as e:
+            logger.error("Could not initialize Google GenAI client: %s", e)
+            logger.warning("Using fallback image generation only")
+            GEMINI_AVAILABLE = False
+    return client
+
+def _close_client(genai_client):
+    # The sync and async httpx pools are separate; close both so exit does not leak sockets
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=GEMINI_API_KEY)
-        client = genai.GenerativeModel('gemini-1.5-flash')  # Adjust model if needed
-        GEMINI_AVAILABLE = True
-        print("Using older google-generativeai")
-    except ImportError as e2:
-        print(f"Import error for older google-generativeai: {str(e2)}")
-        print("No Google GenAI packages available, using fallback only")
-
-def construct_image_prompt(survey_name, medical_specialty, tone, image_style="professional", include_text=True):
-    base_prompt = f"""
-Create a high-quality, professional medical survey campaign image EXCLUSIVELY for healthcare professionals, focusing on {medical_specialty} specialty.
-
-CAMPAIGN DETAILS:
-- Survey Focus: {survey_name}
-- Target Specialty: {medical_specialty} (PRIORITIZE MEDICAL RELEVANCE)
-- Visual Tone: {tone}
-- Style: {image_style} (MANDATORY)
-
-VISUAL REQUIREMENTS:
-- Dimensions: 16:9 landscape format, suitable for email headers and web banners
-- Resolution: High-resolution, crisp and clear
-- Color scheme: Professional medical colors (blues, teals, whites, subtle accent colors)
-- MUST INCLUDE medical imagery specific to {medical_specialty}
-- Clean, uncluttered design with plenty of white space
-"""
-
-    specialty_elements = {
-        "cardiology": "subtle heart imagery, ECG patterns, stethoscope elements, cardiovascular icons",
-        "oncology": "cellular imagery, research lab elements, microscope motifs, hope and healing themes",
-        "primary_care": "diverse patient care imagery, family medicine elements, community health themes",
-        "neurology": "brain imagery, neural networks, neurological examination tools",
-        "pediatrics": "child-friendly colors, pediatric care elements, family-centered themes",
-        "psychiatry": "mental health awareness imagery, brain and mind connection themes",
-        "emergency_medicine": "urgent care elements, emergency room themes, critical care imagery",
-        "surgery": "surgical precision imagery, OR themes, medical precision elements",
-        "radiology": "imaging equipment, scan imagery, diagnostic themes",
-        "pharmacy": "pharmaceutical elements, medication management themes",
-        "general": "universal medical symbols, healthcare collaboration imagery, medical professionalism"
-    }
-
-    specialty_visual = specialty_elements.get(medical_specialty.lower(), specialty_elements["general"])
-    base_prompt += f"\n- Specialty Elements: MANDATORY INCLUSION of {specialty_visual}"
-
-    style_instructions = {
-        "professional": """
+        genai_client.close()
+        asyncio.run(genai_client.aio.aclose())
+    except Exception as e:
+        logger.warning("Could not close Google GenAI client: %s", e)
+
+GEMINI_IMAGE_MODEL = "gemini-2.5-flash-image"
+GEMINI_TIMEOUT_MS = 60_000
+# Image models must be allowed to answer with text alongside the image
+GEMINI_RESPONSE_MODALITIES = ['IMAGE', 'TEXT']
+
+# The sync path runs inside gunicorn's 30s worker timeout, so it retries briefly and then falls back
+SYNC_RETRY_ATTEMPTS = 3
+SYNC_RETRY_BUDGET = 15  # seconds
+
+_BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+# Keep concurrent Gemini calls under the model's rate limit; excess callers queue instead of hitting 429s
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", 8))
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", 10))
+_GEMINI_SYNC_SEM = threading.BoundedSemaphore(GEMINI_CONCURRENCY)
+
+class _RateLimiter:
+    """Thread-safe token bucket allowing max_rate acquisitions per time_period seconds"""
+
+    def __init__(self, max_rate, time_period=60):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = float(max_rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting for a refill; returns False if none arrives within timeout seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.max_rate,
+                                   self._tokens + (now - self._updated) * self.max_rate / self.time_period)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) * self.time_period / self.max_rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+# Per-process like the semaphore: each gunicorn worker gets its own GEMINI_RPM allowance
+_GEMINI_SYNC_RATE_LIMITER = _RateLimiter(max_rate=GEMINI_RPM, time_period=60)
+try:
+    from aiolimiter import AsyncLimiter
+except ImportError:
+    AsyncLimiter = None
+# asyncio primitives bind to the loop that first waits on them, so each event loop gets its own
+_LOOP_LIMITS = weakref.WeakKeyDictionary()  # event loop -> (semaphore, rate limiter or None)
+
+def _gemini_loop_limits():
+    loop = asyncio.get_running_loop()
+    limits = _LOOP_LIMITS.get(loop)
+    if limits is None:
+        rate_limiter = AsyncLimiter(max_rate=GEMINI_RPM, time_period=60) if AsyncLimiter is not None else None
+        limits = _LOOP_LIMITS[loop] = (asyncio.Semaphore(GEMINI_CONCURRENCY), rate_limiter)
+    return limits
+
+# Process-wide pool so image file writes overlap with base64 encoding without per-call thread startup
+_IO_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="image_io")
+
+# Generated images live under static/images; resolved and created once instead of on every save
+_OUTPUT_DIR = os.path.join(os.getcwd(), 'static', 'images')
+_OUTPUT_DIR_REAL = os.path.realpath(_OUTPUT_DIR)
+
+# Filename sanitizing: drop disallowed ASCII in one str.translate pass; non-ASCII titles
+# use the regex so Unicode letters/digits are kept as str.isalnum() would
+_FILENAME_ALLOWED = set(string.ascii_letters + string.digits + ' -_')
+_FILENAME_TRANS = str.maketrans('', '', ''.join(chr(c) for c in range(128) if chr(c) not in _FILENAME_ALLOWED))
+_FILENAME_DISALLOWED_RE = re.compile(r'[^\w \-]')
+
+# Gemini images are cached on disk by prompt hash so repeated templates skip the API call
+_CACHE_DIR = os.path.join(_OUTPUT_DIR, 'cache')
+os.makedirs(_CACHE_DIR, exist_ok=True)
+# Prompts include user-typed survey names, so the oldest files are evicted past this many
+DISK_CACHE_MAX_FILES = int(os.getenv("IMAGE_CACHE_MAX_FILES", 256))
+# prompt hash -> (image_filename, image_base64); bounded since prompts include user-typed survey names
+_PROMPT_CACHE = LRUCache(maxsize=64)
+
+# Recently generated images keyed by filename, so repeated UI/email renders skip re-encoding.
+# Bounded LRUs keep long-running workers from growing without limit.
+THUMBNAIL_SIZE = (256, 144)
+_B64_CACHE = LRUCache(maxsize=64)
+_THUMB_CACHE = LRUCache(maxsize=64)
+_B64_LOCK = threading.Lock()  # guards the LRUs above and _PROMPT_CACHE
+
+_SPECIALTY_ELEMENTS = {
+    "cardiology": "subtle heart imagery, ECG patterns, stethoscope elements, cardiovascular icons",
+    "oncology": "cellular imagery, research lab elements, microscope motifs, hope and healing themes",
+    "primary_care": "diverse patient care imagery, family medicine elements, community health themes",
+    "neurology": "brain imagery, neural networks, neurological examination tools",
+    "pediatrics": "child-friendly colors, pediatric care elements, family-centered themes",
+    "psychiatry": "mental health awareness imagery, brain and mind connection themes",
+    "emergency_medicine": "urgent care elements, emergency room themes, critical care imagery",
+    "surgery": "surgical precision imagery, OR themes, medical precision elements",
+    "radiology": "imaging equipment, scan imagery, diagnostic themes",
+    "pharmacy": "pharmaceutical elements, medication management themes",
+    "general": "universal medical symbols, healthcare collaboration imagery, medical professionalism"
+}
+
+_STYLE_INSTRUCTIONS = {
+    "professional": """
 PROFESSIONAL STYLE:
 - Clean, corporate medical aesthetic
 - Subtle gradients and professional typography
@@ -77,7 +211,7 @@ PROFESSIONAL STYLE:
 - Sophisticated color palette with medical blues and whites
 - Icons and symbols MUST BE minimal and elegant
 """,
-        "infographic": """
+    "infographic": """
 INFOGRAPHIC STYLE:
 - Data visualization elements (charts, graphs, statistics) related to {medical_specialty}
 - Clear information hierarchy
@@ -86,7 +220,7 @@ INFOGRAPHIC STYLE:
 - Bold, readable typography
 - Engaging data presentation elements
 """,
-        "medical_illustration": """
+    "medical_illustration": """
 MEDICAL ILLUSTRATION STYLE:
 - Detailed medical diagrams and anatomical elements specific to {medical_specialty}
 - Scientific accuracy in medical representations
@@ -95,7 +229,7 @@ MEDICAL ILLUSTRATION STYLE:
 - Precise, technical visual elements
 - Professional medical publication style
 """,
-        "clean_modern": """
+    "clean_modern": """
 CLEAN MODERN STYLE:
 - Minimalist design with lots of white space
 - Modern typography and clean lines
@@ -104,12 +238,26 @@ CLEAN MODERN STYLE:
 - Fresh, approachable color palette
 - Modern healthcare facility aesthetics
 """
-    }
+}
 
-    base_prompt += style_instructions.get(image_style.lower(), style_instructions["professional"])
+_PROMPT_HEADER = """
+Create a high-quality, professional medical survey campaign image EXCLUSIVELY for healthcare professionals, focusing on {medical_specialty} specialty.
 
-    if include_text:
-        base_prompt += f"""
+CAMPAIGN DETAILS:
+- Survey Focus: {survey_name}
+- Target Specialty: {medical_specialty} (PRIORITIZE MEDICAL RELEVANCE)
+- Visual Tone: {tone}
+- Style: {image_style} (MANDATORY)
+
+VISUAL REQUIREMENTS:
+- Dimensions: 16:9 landscape format, suitable for email headers and web banners
+- Resolution: High-resolution, crisp and clear
+- Color scheme: Professional medical colors (blues, teals, whites, subtle accent colors)
+- MUST INCLUDE medical imagery specific to {medical_specialty}
+- Clean, uncluttered design with plenty of white space
+"""
+
+_PROMPT_TEXT_OVERLAY = """
 
 TEXT OVERLAY REQUIREMENTS:
 - Main headline: "{survey_name}" (prominent, readable typography)
@@ -119,10 +267,10 @@ TEXT OVERLAY REQUIREMENTS:
 - Use professional, medical-appropriate fonts
 - Ensure text contrast meets accessibility standards
 """
-    else:
-        base_prompt += "\n- Create image without text overlay (background/template only)"
 
-    base_prompt += """
+_PROMPT_NO_TEXT = "\n- Create image without text overlay (background/template only)"
+
+_PROMPT_FOOTER = """
 
 COMPOSITION GUIDELINES:
 - Center-weighted composition with clear focal point
@@ -144,131 +292,553 @@ TECHNICAL SPECIFICATIONS:
 DO NOT generate generic or non-medical images. Focus SOLELY on {medical_specialty}-related medical imagery.
 """
 
-    return base_prompt.strip()
+# Pure function of hashable args; retries and template runs hit the same ~80 specialty/style/text tuples
+@functools.lru_cache(maxsize=512)
+def construct_image_prompt(survey_name, medical_specialty, tone, image_style="professional", include_text=True):
+    specialty_visual = _SPECIALTY_ELEMENTS.get(medical_specialty.lower(), _SPECIALTY_ELEMENTS["general"])
+    return "".join([
+        _PROMPT_HEADER.format(survey_name=survey_name, medical_specialty=medical_specialty,
+                              tone=tone, image_style=image_style),
+        f"\n- Specialty Elements: MANDATORY INCLUSION of {specialty_visual}",
+        _STYLE_INSTRUCTIONS.get(image_style.lower(), _STYLE_INSTRUCTIONS["professional"]),
+        _PROMPT_TEXT_OVERLAY.format(survey_name=survey_name) if include_text else _PROMPT_NO_TEXT,
+        _PROMPT_FOOTER,
+    ]).strip()
 
 def generate_survey_image(survey_name, medical_specialty="general", tone="professional",
-                         image_style="professional", include_text=True, save_filename=None):
+                         image_style="professional", include_text=True, save_filename=None, inline_format="PNG"):
+    """Generate a survey banner and return (pil_image, image_filename, image_base64, image_message).
+
+    The file under static/images is always PNG. inline_format="WEBP" returns a WebP
+    image_base64 instead, which is smaller and faster to encode for inline email use.
+    """
     prompt = construct_image_prompt(survey_name, medical_specialty, tone, image_style, include_text)
 
-    print(f"Generating image for: {survey_name}")
-    print(f"Specialty: {medical_specialty} | Style: {image_style} | Tone: {tone}")
-    print("-" * 60)
+    logger.info("Generating image for: %s", survey_name)
+    logger.info("Specialty: %s | Style: %s | Tone: %s", medical_specialty, image_style, tone)
+    logger.info("-" * 60)
 
-    if GEMINI_AVAILABLE and client is not None:
+    prompt_key = _prompt_key(prompt)
+    cached = _load_cached_image(prompt_key, save_filename)
+    if cached is not None:
+        return _as_inline_format(cached, inline_format)
+
+    if _get_client() is not None:
         pil_image, image_filename, image_base64, image_message = _try_new_gemini_api(
             prompt, survey_name, save_filename)
         if pil_image is not None:
-            return pil_image, image_filename, image_base64, image_message
+            _store_cached_image(prompt_key, image_filename, image_base64)
+            return _as_inline_format((pil_image, image_filename, image_base64, image_message), inline_format)
+
+    logger.info("Using fallback image generation...")
+    return _as_inline_format(
+        _generate_fallback_image(survey_name, medical_specialty, save_filename, include_text), inline_format)
+
+async def generate_survey_image_async(survey_name, medical_specialty="general", tone="professional",
+                                      image_style="professional", include_text=True, save_filename=None,
+                                      inline_format="PNG"):
+    """Async variant of generate_survey_image for fanning out many images concurrently"""
+    prompt = construct_image_prompt(survey_name, medical_specialty, tone, image_style, include_text)
+
+    logger.info("Generating image for: %s", survey_name)
+    logger.info("Specialty: %s | Style: %s | Tone: %s", medical_specialty, image_style, tone)
+    logger.info("-" * 60)
+
+    prompt_key = _prompt_key(prompt)
+    cached = await asyncio.to_thread(_load_cached_image, prompt_key, save_filename)
+    if cached is not None:
+        return await asyncio.to_thread(_as_inline_format, cached, inline_format)
+
+    if _get_client() is not None:
+        pil_image, image_filename, image_base64, image_message = await _try_new_gemini_api_async(
+            prompt, survey_name, save_filename)
+        if pil_image is not None:
+            await asyncio.to_thread(_store_cached_image, prompt_key, image_filename, image_base64)
+            return await asyncio.to_thread(
+                _as_inline_format, (pil_image, image_filename, image_base64, image_message), inline_format)
+
+    logger.info("Using fallback image generation...")
+    result = await asyncio.to_thread(
+        _generate_fallback_image, survey_name, medical_specialty, save_filename, include_text)
+    return await asyncio.to_thread(_as_inline_format, result, inline_format)
+
+async def generate_many(survey_specs):
+    """Generate images for several surveys at once.
+
+    survey_specs is a list of dicts with generate_survey_image keyword arguments.
+    Results are returned in the same order as the specs.
+    """
+    return await asyncio.gather(*[generate_survey_image_async(**spec) for spec in survey_specs])
+
+async def generate_many_via_batch(survey_specs, quality_mode="standard", poll_interval=30, timeout=3600):
+    """Generate images for many surveys with one Gemini batch job.
+
+    Batch jobs cost less and amortize request overhead for large template runs,
+    but they can take minutes to finish and quality may differ from single calls;
+    pass quality_mode="high" to use generate_many instead. Cached prompts are
+    served from the cache and rows the batch fails on go through the single-call path.
+    A job still running after timeout seconds is cancelled and retried the same way.
+    """
+    if quality_mode == "high" or _get_client() is None or not hasattr(client, "aio"):
+        return await generate_many(survey_specs)
+
+    results = [None] * len(survey_specs)
+    pending = []  # (index, spec, prompt_key, prompt)
+    for i, spec in enumerate(survey_specs):
+        prompt = _prompt_for_spec(**spec)
+        prompt_key = _prompt_key(prompt)
+        cached = await asyncio.to_thread(_load_cached_image, prompt_key, spec.get("save_filename"))
+        if cached is None:
+            pending.append((i, spec, prompt_key, prompt))
+        else:
+            results[i] = await asyncio.to_thread(_as_inline_format, cached, spec.get("inline_format", "PNG"))
+    if not pending:
+        return results
 
-    print("Using fallback image generation...")
-    return _generate_fallback_image(survey_name, medical_specialty, save_filename)
+    logger.info("Submitting Gemini batch job for %d images", len(pending))
+    responses = []
+    job = None
+    try:
+        job = await client.aio.batches.create(
+            model=GEMINI_IMAGE_MODEL,
+            src=[{
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "config": {"response_modalities": GEMINI_RESPONSE_MODALITIES},
+            } for _, _, _, prompt in pending],
+            config={"display_name": f"survey_images_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"}
+        )
+        deadline = time.monotonic() + timeout
+        while job.state.name not in _BATCH_DONE_STATES:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Batch job {job.name} still {job.state.name} after {timeout}s")
+            await asyncio.sleep(poll_interval)
+            job = await client.aio.batches.get(name=job.name)
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            raise ValueError(f"Batch job {job.name} finished with state {job.state.name}")
+        responses = job.dest.inlined_responses or []
+    except Exception as e:
+        logger.error("Gemini batch error: %s", e)
+        # Cancel an unfinished job so the rows retried below aren't billed twice
+        if job is not None and job.state.name not in _BATCH_DONE_STATES:
+            try:
+                await client.aio.batches.cancel(name=job.name)
+            except Exception as cancel_error:
+                logger.error("Could not cancel Gemini batch job %s: %s", job.name, cancel_error)
+
+    retry = []
+    for row, (i, spec, prompt_key, _) in enumerate(pending):
+        inline = responses[row] if row < len(responses) else None
+        if inline is not None and inline.response is not None:
+            result = await asyncio.to_thread(
+                _save_gemini_response, inline.response, spec["survey_name"], spec.get("save_filename"))
+            if result[0] is not None:
+                await asyncio.to_thread(_store_cached_image, prompt_key, result[1], result[2])
+                results[i] = await asyncio.to_thread(_as_inline_format, result, spec.get("inline_format", "PNG"))
+                continue
+        retry.append((i, spec))
+
+    if retry:
+        logger.info("Retrying %d images outside the batch job", len(retry))
+        retried = await generate_many([spec for _, spec in retry])
+        for (i, _), result in zip(retry, retried):
+            results[i] = result
+    return results
+
+def _prompt_for_spec(survey_name, medical_specialty="general", tone="professional",
+                     image_style="professional", include_text=True, save_filename=None, inline_format="PNG"):
+    return construct_image_prompt(survey_name, medical_specialty, tone, image_style, include_text)
+
+def _safe_name(survey_name):
+    if survey_name.isascii():
+        return survey_name.translate(_FILENAME_TRANS).rstrip()
+    return _FILENAME_DISALLOWED_RE.sub('', survey_name).rstrip()
+
+def _image_filename(prefix, survey_name, save_filename=None):
+    if save_filename:
+        return save_filename
+    # Concurrent calls for the same survey share a timestamp second, so add a random suffix
+    safe_name = _safe_name(survey_name)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{prefix}_{safe_name.replace(' ', '_')}_{timestamp}_{uuid.uuid4().hex[:8]}.png"
+
+@functools.lru_cache(maxsize=512)
+def _prompt_key(prompt):
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+def _load_cached_image(prompt_key, save_filename=None):
+    from PIL import Image as PILImage
+    with _B64_LOCK:
+        cached = _PROMPT_CACHE.get(prompt_key)
+    if cached is not None:
+        image_filename, image_base64 = cached
+        png_bytes = base64.b64decode(image_base64)
+        logger.info("Using cached image: %s", image_filename)
+    else:
+        cache_path = os.path.join(_CACHE_DIR, f"{prompt_key}.png")
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, 'rb') as f:
+            png_bytes = f.read()
+        # Touch on hit so eviction by mtime drops the least recently used entries first
+        os.utime(cache_path)
+        image_filename = f"cache/{prompt_key}.png"
+        image_base64 = base64.b64encode(png_bytes).decode('utf-8')
+        with _B64_LOCK:
+            _PROMPT_CACHE[prompt_key] = (image_filename, image_base64)
+        _remember_base64(image_filename, image_base64)
+        logger.info("Using cached image: %s", cache_path)
+
+    if save_filename and save_filename != image_filename:
+        # Callers such as generate_image_template expect the image under the name they asked for
+        _write_file(os.path.join(_OUTPUT_DIR, save_filename), png_bytes)
+        _remember_base64(save_filename, image_base64)
+        image_filename = save_filename
+    return PILImage.open(BytesIO(png_bytes)), image_filename, image_base64, "AI-generated image loaded from cache"
+
+def _store_cached_image(prompt_key, image_filename, image_base64):
+    try:
+        # Write this prompt's own bytes; the output file may since have been replaced under the same name
+        _write_file(os.path.join(_CACHE_DIR, f"{prompt_key}.png"), base64.b64decode(image_base64))
+        with _B64_LOCK:
+            _PROMPT_CACHE[prompt_key] = (image_filename, image_base64)
+    except OSError as e:
+        logger.warning("Could not cache image %s: %s", image_filename, e)
+    _prune_disk_cache()
+
+def _prune_disk_cache():
+    try:
+        with os.scandir(_CACHE_DIR) as it:
+            entries = [(entry.stat().st_mtime, entry) for entry in it if entry.name.endswith('.png')]
+    except OSError as e:
+        logger.warning("Could not prune image cache: %s", e)
+        return
+    if len(entries) <= DISK_CACHE_MAX_FILES:
+        return
+    entries.sort(key=lambda item: item[0])
+    for _, entry in entries[:len(entries) - DISK_CACHE_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # another worker evicted it first
+        with _B64_LOCK:
+            # Hits loaded from disk point at the evicted file, so drop them too
+            cached = _PROMPT_CACHE.get(entry.name[:-4])
+            if cached is not None and cached[0] == f"cache/{entry.name}":
+                del _PROMPT_CACHE[entry.name[:-4]]
+
+def clear_cache():
+    """Drop cached prompts and images so the next call goes back to Gemini"""
+    construct_image_prompt.cache_clear()
+    _prompt_key.cache_clear()
+    with _B64_LOCK:
+        _PROMPT_CACHE.clear()
+    shutil.rmtree(_CACHE_DIR, ignore_errors=True)
+    os.makedirs(_CACHE_DIR, exist_ok=True)
+
+def _remember_base64(image_filename, image_base64):
+    with _B64_LOCK:
+        _B64_CACHE[image_filename] = image_base64
+        # The file may have been regenerated under the same name, so its old preview is stale
+        _THUMB_CACHE.pop(image_filename, None)
+
+def _image_path(image_filename):
+    # Filenames come from download URLs, so refuse anything that escapes static/images
+    full_image_path = os.path.realpath(os.path.join(_OUTPUT_DIR_REAL, image_filename))
+    if os.path.commonpath([_OUTPUT_DIR_REAL, full_image_path]) != _OUTPUT_DIR_REAL or not os.path.isfile(full_image_path):
+        return None
+    return full_image_path
+
+def get_cached_base64(image_filename):
+    """Return the base64 PNG for a generated image, or None if it does not exist"""
+    with _B64_LOCK:
+        image_base64 = _B64_CACHE.get(image_filename)
+    if image_base64 is not None:
+        return image_base64
+    full_image_path = _image_path(image_filename)
+    if full_image_path is None:
+        return None
+    with open(full_image_path, 'rb') as f:
+        image_base64 = base64.b64encode(f.read()).decode('utf-8')
+    _remember_base64(image_filename, image_base64)
+    return image_base64
+
+def get_cached_thumbnail(image_filename):
+    """Return a base64 PNG thumbnail (THUMBNAIL_SIZE) for email inline previews, or None"""
+    with _B64_LOCK:
+        thumbnail_base64 = _THUMB_CACHE.get(image_filename)
+    if thumbnail_base64 is not None:
+        return thumbnail_base64
+    full_image_path = _image_path(image_filename)
+    if full_image_path is None:
+        return None
+    from PIL import Image as PILImage
+    with PILImage.open(full_image_path) as pil_image:
+        pil_image.thumbnail(THUMBNAIL_SIZE)
+        thumbnail_base64 = base64.b64encode(_encode_png(pil_image)).decode('utf-8')
+    with _B64_LOCK:
+        _THUMB_CACHE[image_filename] = thumbnail_base64
+    return thumbnail_base64
+
+@functools.lru_cache(maxsize=None)
+def _retryable_errors():
+    # Errors worth retrying: rate limits, overloaded backend and dropped connections
+    errors = ()
+    try:
+        from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
+        errors += (ResourceExhausted, ServiceUnavailable)
+    except ImportError:
+        pass
+    try:
+        import httpx
+        errors += (httpx.TransportError,)
+    except ImportError:
+        pass
+    return errors
+
+def _is_retryable(error):
+    if isinstance(error, _retryable_errors()):
+        return True
+    # google-genai raises APIError with the HTTP status in .code
+    return getattr(error, "code", None) in (429, 500, 503)
+
+def _backoff_delay(attempt):
+    return min(60, (2 ** attempt) + random.random())
+
+def _with_backoff(fn, max_attempts=6, time_budget=None):
+    """Call fn, retrying rate-limit and transient errors with exponential backoff and jitter.
+
+    time_budget (seconds) stops retrying once the next sleep would overrun it.
+    """
+    start = time.monotonic()
+    for attempt in range(max_attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_attempts - 1 or not _is_retryable(e):
+                raise
+            delay = _backoff_delay(attempt)
+            if time_budget is not None and time.monotonic() - start + delay > time_budget:
+                raise
+            logger.warning("Gemini API busy (%s), retrying in %.1fs", e, delay)
+            time.sleep(delay)
+
+async def _with_backoff_async(fn, max_attempts=6):
+    """Async counterpart of _with_backoff; fn is a coroutine function"""
+    for attempt in range(max_attempts):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == max_attempts - 1 or not _is_retryable(e):
+                raise
+            delay = _backoff_delay(attempt)
+            logger.warning("Gemini API busy (%s), retrying in %.1fs", e, delay)
+            await asyncio.sleep(delay)
 
 def _try_new_gemini_api(prompt, survey_name, save_filename=None):
     try:
-        if client is None:
+        if _get_client() is None:
             raise ValueError("Gemini client is not initialized")
-        response = client.generate_content(
-            model="gemini-1.5-flash",  # Update to correct model
-            contents=prompt,
-            generation_config=types.GenerationConfig(
-                response_mime_types=['image/png']  # Specify image output
-            )
-        )
-        image_message = "AI-generated image created successfully"
-        for part in response.candidates[0].content.parts:
-            if part.inline_data is not None:
-                pil_image = PILImage.open(BytesIO(part.inline_data.data))
-                if save_filename:
-                    image_filename = save_filename
-                else:
-                    safe_name = "".join(c for c in survey_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    image_filename = f"survey_image_{safe_name.replace(' ', '_')}_{timestamp}.png"
-                output_dir = os.path.join(os.getcwd(), 'static', 'images')
-                os.makedirs(output_dir, exist_ok=True)
-                full_image_path = os.path.join(output_dir, image_filename)
-                pil_image.save(full_image_path)
-                print(f"Gemini image saved as: {full_image_path}")
-                buffered = BytesIO()
-                pil_image.save(buffered, format="PNG")
-                image_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                return pil_image, image_filename, image_base64, image_message
-        return None, None, None, "No image generated by Gemini API"
+        # The budget covers queueing and the calls themselves, not only the sleeps between retries
+        deadline = time.monotonic() + SYNC_RETRY_BUDGET
+        def generate():
+            if not _GEMINI_SYNC_RATE_LIMITER.acquire(timeout=max(0, deadline - time.monotonic())):
+                raise TimeoutError(f"Gemini rate limit of {GEMINI_RPM}/min reached")
+            if not _GEMINI_SYNC_SEM.acquire(timeout=max(0, deadline - time.monotonic())):
+                raise TimeoutError(f"No Gemini slot free within {SYNC_RETRY_BUDGET}s")
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Gemini retry budget of {SYNC_RETRY_BUDGET}s exhausted")
+                return client.models.generate_content(
+                    model=GEMINI_IMAGE_MODEL,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(
+                        response_modalities=GEMINI_RESPONSE_MODALITIES,
+                        http_options=types.HttpOptions(timeout=int(remaining * 1000))
+                    )
+                )
+            finally:
+                _GEMINI_SYNC_SEM.release()
+        response = _with_backoff(generate, max_attempts=SYNC_RETRY_ATTEMPTS, time_budget=SYNC_RETRY_BUDGET)
+        return _save_gemini_response(response, survey_name, save_filename)
     except Exception as e:
-        print(f"Gemini API error: {str(e)}")
+        logger.error("Gemini API error: %s", e)
         return None, None, None, f"Gemini API error: {str(e)}"
 
-def _generate_fallback_image(survey_name, medical_specialty, save_filename=None):
+async def _try_new_gemini_api_async(prompt, survey_name, save_filename=None):
     try:
-        from PIL import Image, ImageDraw
-        img = Image.new('RGB', (1280, 720), color=(135, 206, 235))  # Light blue background
-        d = ImageDraw.Draw(img)
-        d.text((10, 10), f"{survey_name} - {medical_specialty}", fill=(0, 0, 255), font_size=20)  # Title
-
-        # Specialty-specific fallback images with text and simple shapes
-        if medical_specialty.lower() == "cardiology":
-            d.text((10, 50), "Heart & ECG", fill=(255, 0, 0), font_size=20)  # Red text
-            d.ellipse([50, 100, 150, 200], fill=(255, 0, 0))  # Heart shape approximation
-        elif medical_specialty.lower() == "oncology":
-            d.text((10, 50), "Cells & Microscope", fill=(255, 165, 0), font_size=20)  # Orange
-            d.ellipse([50, 100, 100, 150], fill=(255, 165, 0))  # Cell
-        elif medical_specialty.lower() == "primary_care":
-            d.text((10, 50), "Patient Care", fill=(0, 128, 0), font_size=20)  # Green
-            d.rectangle([50, 100, 150, 200], outline=(0, 128, 0))  # Patient bed
-        elif medical_specialty.lower() == "neurology":
-            d.text((10, 50), "Brain & Neurons", fill=(128, 0, 128), font_size=20)  # Purple
-            d.ellipse([50, 100, 150, 150], fill=(128, 0, 128))  # Brain
-        elif medical_specialty.lower() == "pharmacy":
-            d.text((10, 50), "Medications", fill=(0, 0, 255), font_size=20)  # Blue
-            d.rectangle([50, 100, 100, 150], fill=(0, 0, 255))  # Pill
-        elif medical_specialty.lower() == "pediatrics":
-            d.text((10, 50), "Child Care", fill=(255, 215, 0), font_size=20)  # Yellow
-            d.ellipse([50, 100, 100, 150], fill=(255, 215, 0))  # Child face
-        elif medical_specialty.lower() == "psychiatry":
-            d.text((10, 50), "Mental Health", fill=(75, 0, 130), font_size=20)  # Indigo
-            d.polygon([50, 100, 100, 150, 150, 100], fill=(75, 0, 130))  # Mind wave
-        elif medical_specialty.lower() == "surgery":
-            d.text((10, 50), "Surgical Tools", fill=(139, 69, 19), font_size=20)  # Brown
-            d.line([50, 100, 150, 100], fill=(139, 69, 19), width=5)  # Scalpel
-        elif medical_specialty.lower() == "emergency_medicine":
-            d.text((10, 50), "Urgent Care", fill=(255, 0, 0), font_size=20)  # Red
-            d.rectangle([50, 100, 150, 150], outline=(255, 0, 0))  # Emergency sign
-        elif medical_specialty.lower() == "radiology":
-            d.text((10, 50), "Scans & Imaging", fill=(0, 255, 255), font_size=20)  # Cyan
-            d.rectangle([50, 100, 150, 120], fill=(0, 255, 255))  # Scan line
-        else:
-            d.text((10, 50), "General Medical", fill=(0, 0, 0), font_size=20)  # Black
+        if _get_client() is None or not hasattr(client, "aio"):
+            raise ValueError("Async Gemini client is not initialized")
+        async def generate():
+            semaphore, rate_limiter = _gemini_loop_limits()
+            if rate_limiter is not None:
+                await rate_limiter.acquire()
+            async with semaphore:
+                return await client.aio.models.generate_content(
+                    model=GEMINI_IMAGE_MODEL,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(response_modalities=GEMINI_RESPONSE_MODALITIES)
+                )
+        response = await _with_backoff_async(generate)
+        return await asyncio.to_thread(_save_gemini_response, response, survey_name, save_filename)
+    except Exception as e:
+        logger.error("Gemini API error: %s", e)
+        return None, None, None, f"Gemini API error: {str(e)}"
 
-        if save_filename:
-            image_filename = save_filename
+def _encode_png(pil_image):
+    # Encode once and reuse the bytes for both the file and base64.
+    # compress_level=1 is much faster than Pillow's default 6; banners are ephemeral.
+    buffered = BytesIO()
+    pil_image.save(buffered, format="PNG", optimize=False, compress_level=1)
+    return buffered.getvalue()
+
+def _write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _write_and_encode(full_image_path, png_bytes):
+    """Write png_bytes to disk on the IO pool while base64-encoding them here; returns the base64 string"""
+    write = _IO_EXECUTOR.submit(_write_file, full_image_path, png_bytes)
+    image_base64 = base64.b64encode(png_bytes).decode('utf-8')
+    write.result()
+    return image_base64
+
+def _as_inline_format(result, inline_format):
+    # Results carry PNG base64 (what the caches and the on-disk file hold); re-encode only for WEBP
+    pil_image, image_filename, image_base64, image_message = result
+    if pil_image is None or inline_format.upper() == "PNG":
+        return result
+    if inline_format.upper() != "WEBP":
+        raise ValueError(f"Unsupported inline image format: {inline_format}")
+    buffered = BytesIO()
+    pil_image.save(buffered, format="WEBP", quality=80, method=4)
+    return pil_image, image_filename, base64.b64encode(buffered.getvalue()).decode('utf-8'), image_message
+
+def _save_gemini_response(response, survey_name, save_filename=None):
+    """Save the first image part of a Gemini response and return the usual result tuple.
+
+    PNG bytes from Gemini are written and base64-encoded as-is; the returned PIL image is
+    opened lazily (header only) and is decoded only if the caller actually uses its pixels.
+    """
+    image_message = "AI-generated image created successfully"
+    if not response.candidates or response.candidates[0].content is None:
+        return None, None, None, "No image generated by Gemini API"
+    for part in response.candidates[0].content.parts or []:
+        if part.inline_data is not None:
+            from PIL import Image as PILImage
+            raw = part.inline_data.data
+            pil_image = PILImage.open(BytesIO(raw))
+            image_filename = _image_filename("survey_image", survey_name, save_filename)
+            full_image_path = os.path.join(_OUTPUT_DIR, image_filename)
+            # Only re-encode when Gemini returned something other than PNG
+            png_bytes = raw if part.inline_data.mime_type == "image/png" else _encode_png(pil_image)
+            image_base64 = _write_and_encode(full_image_path, png_bytes)
+            logger.info("Gemini image saved as: %s", full_image_path)
+            _remember_base64(image_filename, image_base64)
+            return pil_image, image_filename, image_base64, image_message
+    return None, None, None, "No image generated by Gemini API"
+
+_FALLBACK_SPECIALTIES = ("cardiology", "oncology", "primary_care", "neurology", "pharmacy", "pediatrics",
+                         "psychiatry", "surgery", "emergency_medicine", "radiology", "general")
+
+def _draw_specialty_glyph(d, specialty):
+    # Specialty-specific fallback images with text and simple shapes
+    if specialty == "cardiology":
+        d.text((10, 50), "Heart & ECG", fill=(255, 0, 0), font_size=20)  # Red text
+        d.ellipse([50, 100, 150, 200], fill=(255, 0, 0))  # Heart shape approximation
+    elif specialty == "oncology":
+        d.text((10, 50), "Cells & Microscope", fill=(255, 165, 0), font_size=20)  # Orange
+        d.ellipse([50, 100, 100, 150], fill=(255, 165, 0))  # Cell
+    elif specialty == "primary_care":
+        d.text((10, 50), "Patient Care", fill=(0, 128, 0), font_size=20)  # Green
+        d.rectangle([50, 100, 150, 200], outline=(0, 128, 0))  # Patient bed
+    elif specialty == "neurology":
+        d.text((10, 50), "Brain & Neurons", fill=(128, 0, 128), font_size=20)  # Purple
+        d.ellipse([50, 100, 150, 150], fill=(128, 0, 128))  # Brain
+    elif specialty == "pharmacy":
+        d.text((10, 50), "Medications", fill=(0, 0, 255), font_size=20)  # Blue
+        d.rectangle([50, 100, 100, 150], fill=(0, 0, 255))  # Pill
+    elif specialty == "pediatrics":
+        d.text((10, 50), "Child Care", fill=(255, 215, 0), font_size=20)  # Yellow
+        d.ellipse([50, 100, 100, 150], fill=(255, 215, 0))  # Child face
+    elif specialty == "psychiatry":
+        d.text((10, 50), "Mental Health", fill=(75, 0, 130), font_size=20)  # Indigo
+        d.polygon([50, 100, 100, 150, 150, 100], fill=(75, 0, 130))  # Mind wave
+    elif specialty == "surgery":
+        d.text((10, 50), "Surgical Tools", fill=(139, 69, 19), font_size=20)  # Brown
+        d.line([50, 100, 150, 100], fill=(139, 69, 19), width=5)  # Scalpel
+    elif specialty == "emergency_medicine":
+        d.text((10, 50), "Urgent Care", fill=(255, 0, 0), font_size=20)  # Red
+        d.rectangle([50, 100, 150, 150], outline=(255, 0, 0))  # Emergency sign
+    elif specialty == "radiology":
+        d.text((10, 50), "Scans & Imaging", fill=(0, 255, 255), font_size=20)  # Cyan
+        d.rectangle([50, 100, 150, 120], fill=(0, 255, 255))  # Scan line
+    else:
+        d.text((10, 50), "General Medical", fill=(0, 0, 0), font_size=20)  # Black
+
+def _build_fallback_templates():
+    # Background and specialty glyph never change, so render them once and copy per call
+    import PIL
+    from PIL import Image as PILImage, ImageDraw
+    # Pillow-SIMD is a drop-in replacement for Pillow (same PIL package); its releases carry a ".postN" suffix
+    logger.info("Using %s %s", "Pillow-SIMD" if ".post" in PIL.__version__ else "Pillow", PIL.__version__)
+    templates = {}
+    for specialty in _FALLBACK_SPECIALTIES:
+        img = PILImage.new('RGB', (1280, 720), color=(135, 206, 235))  # Light blue background
+        _draw_specialty_glyph(ImageDraw.Draw(img), specialty)
+        templates[specialty] = img
+    return templates
+
+_FALLBACK_TEMPLATES = None  # built on the first fallback
+_FALLBACK_TEMPLATE_PNG = {}  # specialty -> encoded PNG of the text-free template
+_FALLBACK_LOCK = threading.Lock()
+
+def _fallback_templates():
+    global _FALLBACK_TEMPLATES
+    if _FALLBACK_TEMPLATES is None:
+        with _FALLBACK_LOCK:
+            if _FALLBACK_TEMPLATES is None:
+                _FALLBACK_TEMPLATES = _build_fallback_templates()
+    return _FALLBACK_TEMPLATES
+
+def _generate_fallback_image(survey_name, medical_specialty, save_filename=None, include_text=True):
+    try:
+        from PIL import ImageDraw
+        templates = _fallback_templates()
+        specialty = medical_specialty.lower()
+        if specialty not in templates:
+            specialty = "general"
+        img = templates[specialty].copy()
+        if include_text:
+            d = ImageDraw.Draw(img)
+            d.text((10, 10), f"{survey_name} - {medical_specialty}", fill=(0, 0, 255), font_size=20)  # Title
+            png_bytes = _encode_png(img)
         else:
-            safe_name = "".join(c for c in survey_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            image_filename = f"fallback_{safe_name.replace(' ', '_')}_{timestamp}.png"
+            png_bytes = _FALLBACK_TEMPLATE_PNG.get(specialty)
+            if png_bytes is None:
+                png_bytes = _FALLBACK_TEMPLATE_PNG[specialty] = _encode_png(img)
 
-        output_dir = os.path.join(os.getcwd(), 'static', 'images')
-        os.makedirs(output_dir, exist_ok=True)
-        full_image_path = os.path.join(output_dir, image_filename)
-        img.save(full_image_path)
-        print(f"Fallback image saved as: {full_image_path}")
+        image_filename = _image_filename("fallback", survey_name, save_filename)
 
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        image_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        full_image_path = os.path.join(_OUTPUT_DIR, image_filename)
+        image_base64 = _write_and_encode(full_image_path, png_bytes)
+        logger.info("Fallback image saved as: %s", full_image_path)
+        _remember_base64(image_filename, image_base64)
 
         image_message = "Professional fallback image generated successfully."
-        print("Description:", image_message)
-        print("-" * 60)
+        logger.info("Description: %s", image_message)
+        logger.info("-" * 60)
 
         return img, image_filename, image_base64, image_message
 
     except Exception as e:
-        print(f"Error generating fallback image: {str(e)}")
+        logger.error("Error generating fallback image: %s", e)
         return None, None, None, str(e)
 
 # Example 1: Cardiology Survey - Professional Style (This section is for standalone testing,
 # and will not run when imported by app.py unless specified)
 if __name__ == '__main__':
+    configure_logging()
     print("GENERATING CARDIOLOGY SURVEY IMAGE")
     print("=" * 60)
     generate_survey_image(